@@ -1,26 +1,134 @@
-import json
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree
 from flask import Flask, render_template, request
 from flask import send_from_directory
 import os
-from collections import defaultdict
-from gevent.pywsgi import WSGIServer
+import functools
+import hashlib
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.chrome.service import Service
-from selenium.common.exceptions import NoSuchElementException
 
-search_history = []
+logger = logging.getLogger(__name__)
+
+# Most recent search terms; older entries are dropped once the limit is reached
+search_history = deque(maxlen=50)
+
+# Read at import time so the keys are also set when served by flask run or gunicorn
+load_dotenv()
+API_KEY = os.environ.get("GOOGLE_BOOKS_API_KEY")  # Google Books API key
+OMDB_API_KEY = os.environ.get("OMDB_API_KEY")  # OMDB API key
+NEWS_API_KEY = os.environ.get("NEWS_API_KEY")  # News API key
+
+# (connect, read) timeout in seconds for every outbound request
+REQUEST_TIMEOUT = (3, 10)
+
+# Shared HTTP session so connections to each API host are kept alive and reused
+SESSION = requests.Session()
+SESSION.headers.update({'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.159 Safari/537.36'})
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=Retry(total=2, backoff_factor=0.2))
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# IMDb scrapes go through the circuit breaker, so they get a session without adapter retries;
+# otherwise each failure would take up to three timed-out attempts before being counted
+IMDB_SESSION = requests.Session()
+IMDB_SESSION.headers.update(SESSION.headers)
+IMDB_SESSION.mount('https://', HTTPAdapter(pool_maxsize=8, max_retries=0))
+
+# Store for cached Google Books responses and IMDb descriptions, opened once and shared across threads
+CACHE_DB = sqlite3.connect('cache.db', check_same_thread=False)
+CACHE_DB.execute('CREATE TABLE IF NOT EXISTS responses(k TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, fetched REAL)')
+CACHE_DB.execute('CREATE TABLE IF NOT EXISTS descriptions(imdb_id TEXT PRIMARY KEY, description TEXT, expires REAL)')
+CACHE_LOCK = threading.Lock()
+
+# How long a cached Google Books response is served without revalidating it, in seconds
+RESPONSE_MAX_AGE = 3600
+
+def cache_get(key):
+    """
+    Look up a response in the cache store.
+
+    Args:
+        key (str): The cache key.
+
+    Returns:
+        tuple: A tuple of (body, etag, last_modified, fetched), or None if the key is not cached.
+    """
+    with CACHE_LOCK:
+        return CACHE_DB.execute('SELECT body, etag, last_modified, fetched FROM responses WHERE k = ?',
+                                (key,)).fetchone()
+
+def cache_set(key, body, etag=None, last_modified=None):
+    """
+    Store a response in the cache store, replacing any existing entry.
+
+    Args:
+        key (str): The cache key.
+        body (bytes): The raw response body.
+        etag (str, optional): The response's ETag header. Defaults to None.
+        last_modified (str, optional): The response's Last-Modified header. Defaults to None.
+    """
+    with CACHE_LOCK:
+        CACHE_DB.execute('INSERT OR REPLACE INTO responses(k, body, etag, last_modified, fetched) VALUES (?, ?, ?, ?, ?)',
+                         (key, body, etag, last_modified, time.time()))
+        CACHE_DB.commit()
+
+# How long a scraped IMDb description is kept on disk, in seconds
+DESCRIPTION_TTL = 30 * 86400
+
+def description_cache_get(imdb_id):
+    """
+    Look up an unexpired movie description in the cache store.
+
+    Args:
+        imdb_id (str): The IMDb ID of the movie.
+
+    Returns:
+        str: The cached description, or None if it is not cached or has expired.
+    """
+    with CACHE_LOCK:
+        row = CACHE_DB.execute('SELECT description FROM descriptions WHERE imdb_id = ? AND expires > ?',
+                               (imdb_id, time.time())).fetchone()
+    return row[0] if row else None
+
+def description_cache_set(imdb_id, description):
+    """
+    Store a movie description in the cache store for DESCRIPTION_TTL seconds.
+
+    Args:
+        imdb_id (str): The IMDb ID of the movie.
+        description (str): The movie description.
+    """
+    with CACHE_LOCK:
+        CACHE_DB.execute('INSERT OR REPLACE INTO descriptions(imdb_id, description, expires) VALUES (?, ?, ?)',
+                         (imdb_id, description, time.time() + DESCRIPTION_TTL))
+        CACHE_DB.commit()
+
+# Concurrent searches per process; keep in sync with gunicorn's --threads in the README
+SEARCH_THREADS = 8
+
+# Shared pool for the independent Google Books, OMDb and News API lookups. Each search holds
+# at most 3 of its threads (the OMDb one for its whole IMDb fan-out), so with 3 per search
+# thread no search's lookups ever queue behind another search
+API_POOL = ThreadPoolExecutor(max_workers=3 * SEARCH_THREADS)
+# Shared pool for the per-movie IMDb scrapes; each one is a blocking HTTP GET
+IMDB_POOL = ThreadPoolExecutor(max_workers=8)
 
 class Book:
     """
     A class to represent a book.
     """
+    __slots__ = ('title', 'author', 'release_year', 'url', 'genres', 'average_rating')
+
     def __init__(self, title="No Title", author="No Author", release_year="No Release Year", 
                  url="No URL", genres=None, average_rating=None, json=None):
         """
@@ -70,6 +178,75 @@ class Book:
         return f"{self.title} by {self.author} ({self.release_year})"
 
 
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of making a request while a circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    A decorator that stops calling a failing upstream service for a while.
+
+    After fail_max consecutive connection errors, timeouts or 5xx responses the circuit opens and calls raise
+    CircuitOpenError immediately. Once reset_timeout seconds have passed, one call is
+    let through; if it succeeds the circuit closes again, otherwise it stays open.
+    """
+    def __init__(self, fail_max=5, reset_timeout=30):
+        """
+        Constructs all the necessary attributes for the CircuitBreaker object.
+
+        Parameters
+        ----------
+        fail_max : int, optional
+            The number of consecutive failures that opens the circuit (default 5)
+        reset_timeout : float, optional
+            The number of seconds to wait before trying the service again (default 30)
+        """
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def __call__(self, func):
+        """
+        Wraps func so that its calls go through the circuit breaker.
+
+        Returns
+        -------
+        function
+            The wrapped function.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.lock:
+                if self.opened_at is not None:
+                    if time.monotonic() - self.opened_at < self.reset_timeout:
+                        raise CircuitOpenError(f"{func.__name__} is unavailable")
+                    # Let this call through as a trial; restarting the timer keeps other calls failing fast meanwhile
+                    self.opened_at = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except requests.exceptions.RequestException as e:
+                status = getattr(e.response, 'status_code', None)
+                with self.lock:
+                    if status is not None and status < 500:
+                        # A 4xx is about this request, and shows the service is answering
+                        self.failures = 0
+                        self.opened_at = None
+                    else:
+                        self.failures += 1
+                        if self.failures >= self.fail_max:
+                            self.opened_at = time.monotonic()
+                raise
+            with self.lock:
+                self.failures = 0
+                self.opened_at = None
+            return result
+        return wrapper
+
+
 def search_books(query, api_key, max_results=10, start_index=0, lang=None, 
                  order_by=None, author=None, genre=None, min_rating=None):
     """
@@ -91,52 +268,67 @@ def search_books(query, api_key, max_results=10, start_index=0, lang=None,
     --------
     tuple: A tuple containing a list of Book objects and the total number of items found.
     """
-    # Create a cache directory if it doesn't exist
-    cache_dir = 'cache'
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)
-
     # Check if the data is already cached
-    cache_file = os.path.join(cache_dir, f"{query}_{start_index}.json")
-    if os.path.exists(cache_file):
-        with open(cache_file, 'r') as f:
-            data = json.load(f)
+    cache_key = hashlib.blake2b(f"{query}|{start_index}|{max_results}|{lang}|{order_by}".encode()).hexdigest()
+    cached = cache_get(cache_key)
+    if cached is not None and time.time() - cached[3] < RESPONSE_MAX_AGE:
+        body = cached[0]
     else:
-        url = f"https://www.googleapis.com/books/v1/volumes?q={query}&maxResults={max_results}&startIndex={start_index}&key={api_key}"
+        url = "https://www.googleapis.com/books/v1/volumes"
+        params = {'q': query, 'maxResults': max_results, 'startIndex': start_index, 'key': api_key,
+                  # Partial response: only the fields Book reads
+                  'fields': 'totalItems,items(volumeInfo(title,authors,publishedDate,previewLink,categories,averageRating))'}
         if lang:
-            url += f"&langRestrict={lang}"
+            params['langRestrict'] = lang
         if order_by:
-            url += f"&orderBy={order_by}"
+            params['orderBy'] = order_by
+
+        # Revalidate a stale cached response instead of downloading it again
+        headers = {}
+        if cached is not None:
+            body, etag, last_modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
         try:
-            response = requests.get(url)
+            response = SESSION.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
-            raise e
-        data = json.loads(response.text)
-        
-        # Cache the data
-        with open(cache_file, 'w') as f:
-            json.dump(data, f)
+            if cached is None:
+                raise e
+            # Serve the stale copy rather than failing the whole search; the next search retries
+            # Never log str(e): it contains the request URL, and with it the API key
+            logger.warning("Google Books revalidation failed (%s, status %s), serving cached response",
+                           type(e).__name__, getattr(e.response, 'status_code', None))
+            response = None
+
+        if response is not None:
+            if response.status_code == 304:
+                cache_set(cache_key, body, response.headers.get('ETag', etag),
+                          response.headers.get('Last-Modified', last_modified))
+            else:
+                body = response.content
+
+                # Cache the raw response with its validators
+                cache_set(cache_key, body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    data = orjson.loads(body)
 
     total_items = data.get("totalItems", 0)
     results = data.get("items", [])
-    book_list = []
-    for result in results:
-        book = Book(json=result)
-        book_list.append(book)
-
-    # Apply filters
-    if author or genre or min_rating:
-        filtered_books = []
-        for book in book_list:
-            if author and author.lower() not in book.author.lower():
-                continue
-            if genre and genre not in book.genres:
-                continue
-            if min_rating and book.average_rating < min_rating:
-                continue
-            filtered_books.append(book)
-        book_list = filtered_books
+    book_list = [Book(json=result) for result in results]
+
+    # Apply filters, building the checks once so unused filters cost nothing per book
+    filters = []
+    if author:
+        author = author.lower()
+        filters.append(lambda book: author in book.author.lower())
+    if genre:
+        filters.append(lambda book: genre in book.genres)
+    if min_rating is not None:
+        filters.append(lambda book: book.average_rating >= min_rating)
+    if filters:
+        book_list = [book for book in book_list if all(check(book) for check in filters)]
 
     return book_list, total_items
 
@@ -153,19 +345,30 @@ def search_movies(book_title, api_key):
     -------
     list: A list of dictionaries containing movie information.
     """
-    url = f"http://www.omdbapi.com/?apikey={api_key}&s={book_title}&type=movie"
+    return [{"Title": title, "imdbID": imdb_id} for title, imdb_id in _search_movies_cached(book_title, api_key)]
+
+@functools.lru_cache(maxsize=4096)
+def _search_movies_cached(book_title, api_key):
+    """
+    Memoized OMDb lookup backing search_movies.
+
+    Returns
+    -------
+    tuple: A tuple of (title, imdbID) pairs, kept immutable so cached results can be shared.
+    """
+    url = "http://www.omdbapi.com/"
+    params = {'apikey': api_key, 's': book_title, 'type': 'movie'}
     try:
-        response = requests.get(url)
+        response = SESSION.get(url, params=params, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         raise e
-    data = json.loads(response.text)
+    data = orjson.loads(response.content)
     if data["Response"] == "True":
         results = data["Search"]
-        movie_info = [{"Title": result["Title"], "imdbID": result["imdbID"]} for result in results]
-        return movie_info
+        return tuple((result["Title"], result["imdbID"]) for result in results)
     else:
-        return []
+        return ()
     
 def search_articles(query, api_key, page=1, max_articles=10, lang=None):
     """
@@ -181,29 +384,26 @@ def search_articles(query, api_key, page=1, max_articles=10, lang=None):
     Returns:
         list: A list of dictionaries containing article information.
     """
-    url = f'https://newsapi.org/v2/everything?q={query}&apiKey={api_key}&page={page}'
-    
+    url = 'https://newsapi.org/v2/everything'
+    params = {'q': query, 'apiKey': api_key, 'page': page}
+
     if lang:
-        url += f"&language={lang}"
+        params['language'] = lang
 
-    response = requests.get(url)
-    data = response.json()
+    response = SESSION.get(url, params=params, timeout=REQUEST_TIMEOUT)
+    data = orjson.loads(response.content)
 
     if 'articles' not in data:
         return []
 
-    articles = []
-    for article in data['articles']:
-        articles.append({
-            'title': article['title'],
-            'url': article['url'],
-            'source': article['source']['name'],
-            'publishedAt': article['publishedAt']
-        })
-
-    articles = sorted(articles, key=lambda x: x['publishedAt'])
+    articles = ({
+        'title': article['title'],
+        'url': article['url'],
+        'source': article['source']['name'],
+        'publishedAt': article['publishedAt']
+    } for article in data['articles'])
 
-    return articles[:max_articles]
+    return heapq.nsmallest(max_articles, articles, key=lambda x: x['publishedAt'])
 
 def create_genre_graph(book_list):
     """
@@ -231,13 +431,8 @@ def find_most_common_genres(book_list):
     Returns:
         tuple: A tuple containing a list of the most common genres and a dictionary with genre as the key and a list of books as the value.
     """
-    genre_graph = {}
-    for book in book_list:
-        for genre in book.genres:
-            if genre not in genre_graph:
-                genre_graph[genre] = []
-            genre_graph[genre].append(book)
-    most_common_genres = sorted(genre_graph.keys(), key=lambda x: len(genre_graph[x]), reverse=True)
+    genre_graph = create_genre_graph(book_list)
+    most_common_genres = sorted(genre_graph, key=lambda x: len(genre_graph[x]), reverse=True)
     return most_common_genres, genre_graph
 
 
@@ -253,9 +448,29 @@ def find_highest_rated_books(book_list):
     """
     return sorted(book_list, key=lambda x: x.average_rating, reverse=True)
 
+@functools.lru_cache(maxsize=4096)
 def get_movie_description(imdb_id):
     """
-    Get the movie description from IMDb by IMDb ID.
+    Get the movie description by IMDb ID, from the disk cache if possible and IMDb otherwise.
+
+    Args:
+        imdb_id (str): The IMDb ID of the movie.
+
+    Returns:
+        str: A string containing the movie description.
+    """
+    description = description_cache_get(imdb_id)
+    if description is None:
+        description = scrape_movie_description(imdb_id)
+        # Leave misses uncached on disk so they are retried after a restart
+        if description != "Description not found.":
+            description_cache_set(imdb_id, description)
+    return description
+
+@CircuitBreaker(fail_max=5, reset_timeout=30)
+def scrape_movie_description(imdb_id):
+    """
+    Scrape the movie description from IMDb by IMDb ID.
 
     Args:
         imdb_id (str): The IMDb ID of the movie.
@@ -264,27 +479,63 @@ def get_movie_description(imdb_id):
         str: A string containing the movie description.
     """
     url = f"https://www.imdb.com/title/{imdb_id}/"
-    headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.159 Safari/537.36'}
     try:
-        response = requests.get(url, headers=headers)
+        response = IMDB_SESSION.get(url, timeout=REQUEST_TIMEOUT, stream=True)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         raise e
 
-    soup = BeautifulSoup(response.text, 'html.parser')
-    
-    # Find the description tag
-    description_tag = soup.find('span', {'data-testid': 'plot-xl', 'class': 'sc-5f699a2-2 cxqNYC'})
-    
-    if description_tag:
-        description = description_tag.text.strip()
-    else:
-        description = "Description not found."
+    # Parse the page as it downloads and stop reading once the description tag has been seen
+    parser = etree.HTMLPullParser(events=('end',), tag='span', encoding=response.encoding or 'utf-8')
+    description = "Description not found."
+    with response:
+        for chunk in response.iter_content(8192):
+            parser.feed(chunk)
+            description_tag = next((element for _, element in parser.read_events()
+                                    if element.get('data-testid') == 'plot-xl'), None)
+            if description_tag is not None:
+                description = ''.join(description_tag.itertext()).strip()
+                break
 
     return description
 
+def get_movie_description_safe(imdb_id):
+    """
+    Get the movie description from IMDb, falling back to a placeholder on failure.
+
+    Args:
+        imdb_id (str): The IMDb ID of the movie.
+
+    Returns:
+        str: The movie description, or "Description not available." if the request failed
+            or IMDb is currently being skipped after repeated failures.
+    """
+    try:
+        return get_movie_description(imdb_id)
+    except requests.exceptions.RequestException:
+        return "Description not available."
+
+def search_movies_with_descriptions(book_title, api_key):
+    """
+    Search for movies using the OMDb API and fetch their IMDb descriptions concurrently.
+
+    Args:
+        book_title (str): The search query.
+        api_key (str): The OMDb API key.
+
+    Returns:
+        tuple: A tuple containing the list of movie dictionaries and the list of their descriptions.
+    """
+    movie_data = search_movies(book_title, api_key)
+    movie_descriptions = list(IMDB_POOL.map(get_movie_description_safe, (movie['imdbID'] for movie in movie_data)))
+    return movie_data, movie_descriptions
+
 app = Flask(__name__)
 
+# Load and compile the templates at startup rather than on each worker's first request
+app.jinja_env.get_template('index.html')
+app.jinja_env.get_template('results.html')
+
 @app.route('/')
 def index():
     """
@@ -325,17 +576,17 @@ def search():
 
     # Get the current page for news articles
     current_page = int(request.form.get('current_page', 1))
-    book_list, total_items = search_books(user_input, API_KEY, max_results=10, start_index=start_index, lang=lang_filter, order_by=order_by, author=author_filter, genre=genre_filter, min_rating=min_rating_filter)
-    movie_data = search_movies(user_input, OMDB_API_KEY)
-    # print("Movie Data:", movie_data)
 
-    # Get movie descriptions
-    movie_descriptions = []
-    for movie in movie_data:
-        description = get_movie_description(movie['imdbID'])
-        movie_descriptions.append(description)
+    # The three APIs are independent, so query them concurrently; the IMDb descriptions
+    # are fetched as soon as the OMDb results arrive, overlapping the book and news lookups
+    books_future = API_POOL.submit(search_books, user_input, API_KEY, max_results=10, start_index=start_index, lang=lang_filter, order_by=order_by, author=author_filter, genre=genre_filter, min_rating=min_rating_filter)
+    movies_future = API_POOL.submit(search_movies_with_descriptions, user_input, OMDB_API_KEY)
+    articles_future = API_POOL.submit(search_articles, user_input, NEWS_API_KEY, page=current_page, lang=lang_filter)
+    book_list, total_items = books_future.result()
+    movie_data, movie_descriptions = movies_future.result()
+    news_articles = articles_future.result()
+    # print("Movie Data:", movie_data)
 
-    news_articles = search_articles(user_input, NEWS_API_KEY, page=current_page, lang=lang_filter)
     most_common_genres, genre_graph = find_most_common_genres(book_list)
     highest_rated_books = find_highest_rated_books(book_list)
     zipped_movie_data = zip(movie_data, movie_descriptions)
@@ -359,9 +610,6 @@ def favicon():
     return send_from_directory(os.path.join(app.root_path, 'static'), 'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
 if __name__ == "__main__":
-    API_KEY = os.environ.get("GOOGLE_BOOKS_API_KEY")  # Google Books API key
-    OMDB_API_KEY = os.environ.get("OMDB_API_KEY")  # OMDB API key
-    NEWS_API_KEY = os.environ.get("NEWS_API_KEY")  # News API key
     app.run(debug=True)
 
 